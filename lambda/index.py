@@ -1,26 +1,6 @@
 import os
 import json
 import logging
-import sys
-from pip._internal import main
-
-main(
-    [
-        "install",
-        "-I",
-        "-q",
-        "boto3",
-        "requests",
-        "opensearch-py==2.4.2",
-        "urllib3",
-        "--target",
-        "/tmp/",
-        "--no-cache-dir",
-        "--disable-pip-version-check",
-    ]
-)
-sys.path.insert(0, "/tmp/")
-
 import boto3
 import requests
 from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
@@ -50,6 +30,52 @@ def get_opensearch_client(endpoint):
     )
 
 
+def build_index_body(
+    vector_dimension, vector_data_type, hnsw_m, hnsw_ef_construction, quantize_max_abs
+):
+    vector_field = {
+        "type": "knn_vector",
+        "dimension": vector_dimension,
+        "method": {
+            "engine": "faiss",
+            "name": "hnsw",
+            "space_type": "l2",
+            "parameters": {
+                "m": hnsw_m,
+                "ef_construction": hnsw_ef_construction,
+            },
+        },
+    }
+    mappings = {
+        "properties": {
+            "text": {"type": "text"},
+            "vector_field": vector_field,
+            "metadata": {"type": "object"},  # Thêm trường metadata từ config gốc
+        }
+    }
+    if vector_data_type == "byte":
+        vector_field["data_type"] = "byte"
+    if vector_data_type == "byte" and quantize_max_abs is not None:
+        # Writers and readers quantize with this scale, so it lives with the index.
+        # Without one, the ingestion Lambda calibrates it from real embeddings.
+        mappings["_meta"] = {"quantize_max_abs": quantize_max_abs}
+
+    return {
+        "settings": {
+            "index": {
+                "knn": True,
+            }
+        },
+        "mappings": mappings,
+    }
+
+
+def get_vector_data_type(opensearch_client, index_name):
+    mapping = opensearch_client.indices.get_mapping(index=index_name)
+    properties = next(iter(mapping.values()))["mappings"]["properties"]
+    return properties["vector_field"].get("data_type", "float")
+
+
 def handler(event, context):
     logger.info("Received event: %s", json.dumps(event, indent=2))
 
@@ -57,6 +83,11 @@ def handler(event, context):
     opensearch_endpoint = event.get("Endpoint")
     index_name = event.get("IndexName")
     vector_dimension = event.get("VectorDimension", 1024)
+    vector_data_type = event.get("VectorDataType", "float")
+    hnsw_m = event.get("HnswM", 16)
+    hnsw_ef_construction = event.get("HnswEfConstruction", 128)
+    quantize_max_abs = event.get("QuantizeMaxAbs")
+    recreate_on_mismatch = event.get("RecreateOnMismatch", False)
 
     if not opensearch_endpoint or not index_name:
         logger.error("Missing required parameters: Endpoint or IndexName")
@@ -68,30 +99,13 @@ def handler(event, context):
         # Cấu hình index với dimension động
         params = {
             "index": index_name,
-            "body": {
-                "settings": {
-                    "index": {
-                        "knn": True,
-                    }
-                },
-                "mappings": {
-                    "properties": {
-                        "text": {"type": "text"},
-                        "vector_field": {
-                            "type": "knn_vector",
-                            "dimension": vector_dimension,
-                            "method": {
-                                "engine": "nmslib",
-                                "name": "hnsw",
-                                "space_type": "l2",
-                            },
-                        },
-                        "metadata": {
-                            "type": "object"
-                        },  # Thêm trường metadata từ config gốc
-                    }
-                },
-            },
+            "body": build_index_body(
+                vector_dimension,
+                vector_data_type,
+                hnsw_m,
+                hnsw_ef_construction,
+                quantize_max_abs,
+            ),
         }
 
         # Xử lý các loại request
@@ -112,6 +126,59 @@ def handler(event, context):
                     "body": json.dumps(f"Error creating index: {str(e)}"),
                 }
 
+        elif event.get("RequestType") == "Update":
+            # knn_vector data types can't be changed in place; an existing index keeps
+            # its format (ingestion follows the mapping) unless recreation is requested
+            try:
+                if not opensearch_client.indices.exists(index=index_name):
+                    opensearch_client.indices.create(
+                        index=params["index"], body=params["body"]
+                    )
+                    logger.info(f"Index {index_name} created successfully")
+                    return {
+                        "statusCode": 200,
+                        "body": json.dumps(f"Index {index_name} created"),
+                    }
+
+                current_data_type = get_vector_data_type(opensearch_client, index_name)
+                if current_data_type == vector_data_type:
+                    logger.info(f"Index {index_name} is up to date")
+                    return {
+                        "statusCode": 200,
+                        "body": json.dumps(f"Index {index_name} is up to date"),
+                    }
+
+                if not recreate_on_mismatch:
+                    logger.warning(
+                        f"Index {index_name} uses {current_data_type} vectors, "
+                        f"requested {vector_data_type}; keeping the existing index"
+                    )
+                    return {
+                        "statusCode": 200,
+                        "body": json.dumps(
+                            f"Index {index_name} kept with {current_data_type} vectors"
+                        ),
+                    }
+
+                opensearch_client.indices.delete(index=index_name)
+                opensearch_client.indices.create(
+                    index=params["index"], body=params["body"]
+                )
+                logger.info(
+                    f"Index {index_name} recreated with {vector_data_type} vectors; "
+                    "documents must be re-ingested"
+                )
+                return {
+                    "statusCode": 200,
+                    "body": json.dumps(f"Index {index_name} recreated"),
+                }
+            except Exception as e:
+                logger.error(f"Error updating index: {e}")
+                return {
+                    "statusCode": 500,
+                    "body": json.dumps(f"Error updating index: {str(e)}"),
+                }
+
         elif event.get("RequestType") == "Delete":
             try:
                 opensearch_client.indices.delete(index=index_name)
@@ -1,175 +1,714 @@
+import io
 import os
 import json
 import logging
-import sys
-
-# from pip._internal import main
-
-# # Install required packages at runtime
-# main(
-#     [
-#         "install",
-#         "-I",
-#         "-q",
-#         "boto3",
-#         "requests",
-#         "opensearch-py==2.4.2",
-#         "urllib3",
-#         "google-generativeai",
-#         "langchain-core",
-#         "langchain-core",
-#         "langchain_google_genai",
-#         "requests-aws4auth",
-#         "--target",
-#         "/tmp/",
-#         "--no-cache-dir",
-#         "--disable-pip-version-check",
-#     ]
-# )
-# sys.path.insert(0, "/tmp/")
-
-import os
-import json
-import logging
+import mimetypes
+import random
+import hashlib
+import asyncio
+import threading
+import time
+import aiohttp
 import boto3
-from typing import Dict, Any, List
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from botocore.credentials import RefreshableCredentials
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from typing import Dict, Any, List, Optional, Tuple
+from aws_secretsmanager_caching import SecretCache, SecretCacheConfig
 from requests_aws4auth import AWS4Auth
-from opensearchpy import RequestsHttpConnection
+from opensearchpy import OpenSearch, RequestsHttpConnection
+from opensearchpy.helpers import bulk
+from langchain_core.documents import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-import google.generativeai as genai
-from langchain_community.vectorstores import OpenSearchVectorSearch
-from langchain_community.document_loaders.s3_file import S3FileLoader
+from pypdf import PdfReader
+from docx import Document as DocxDocument
+from pptx import Presentation
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
-# Function to fetch secrets from AWS Secrets Manager
-def get_secret(secret_name: str, region_name: str) -> Dict[str, str]:
-    client = boto3.client("secretsmanager", region_name=region_name)
+SECRET_NAME = "dev/rag-demo/all"
+SECRET_REGION = "ap-southeast-1"
+SECRET_REFRESH_INTERVAL = 3600
+
+# In-process secret cache, kept across warm invocations and refreshed hourly.
+# Credentials are read through it at the point of use so rotations are picked up.
+secret_cache = SecretCache(
+    config=SecretCacheConfig(secret_refresh_interval=SECRET_REFRESH_INTERVAL),
+    client=boto3.client("secretsmanager", region_name=SECRET_REGION),
+)
+
+
+# Function to fetch secrets from AWS Secrets Manager (through the cache)
+def get_secret(secret_name: str) -> Dict[str, str]:
     try:
-        get_secret_value_response = client.get_secret_value(SecretId=secret_name)
-        secret = get_secret_value_response["SecretString"]
-        return json.loads(secret)
+        return json.loads(secret_cache.get_secret_string(secret_name))
     except Exception as e:
         logger.error(f"Error fetching secret {secret_name}: {str(e)}")
         raise e
 
 
+def google_api_key() -> str:
+    return get_secret(SECRET_NAME)["GOOGLE_API_KEY"]
+
+
+def opensearch_credentials() -> Dict[str, Any]:
+    """Current OpenSearch credentials, in botocore refreshable-credentials form"""
+    current = get_secret(SECRET_NAME)
+    expiry = datetime.now(timezone.utc) + timedelta(seconds=SECRET_REFRESH_INTERVAL)
+    return {
+        "access_key": current["AWS_ACCESS_KEY_ID"],
+        "secret_key": current["AWS_SECRET_ACCESS_KEY"],
+        "token": None,
+        "expiry_time": expiry.isoformat(),
+    }
+
+
 # Fetch secrets
-secrets = get_secret("dev/rag-demo/all", "ap-southeast-1")
+secrets = get_secret(SECRET_NAME)
 
-# Configuration from secrets
-GOOGLE_API_KEY = secrets["GOOGLE_API_KEY"]
+# Non-rotating configuration from secrets, read once per container
 OPENSEARCH_DOMAIN_ENDPOINT = secrets["OPENSEARCH_HOST"]
-OPENSEARCH_AWS_ACCESS_KEY_ID = secrets["AWS_ACCESS_KEY_ID"]
-OPENSEARCH_AWS_SECRET_ACCESS_KEY = secrets["AWS_SECRET_ACCESS_KEY"]
 OPENSEARCH_REGION = secrets["OP_AWS_REGION"]
+# OpenSearch Serverless collections refresh on their own and reject _refresh
+IS_AOSS = "aoss" in OPENSEARCH_DOMAIN_ENDPOINT
 
 S3_REGION = secrets["S3_AWS_REGION"]
-S3_BUCKET_NAME = os.environ.get["S3_BUCKET_NAME"]
-# S3_BUCKET_NAME = secrets["S3_BUCKET_NAME"]
-
-S3_AWS_ACCESS_KEY_ID = secrets["AWS_ACCESS_KEY_ID"]
-S3_AWS_SECRET_ACCESS_KEY = secrets["AWS_SECRET_ACCESS_KEY"]
+S3_BUCKET_NAME = os.environ.get("S3_BUCKET_NAME", secrets.get("S3_BUCKET_NAME"))
+if not S3_BUCKET_NAME:
+    # Fail during INIT rather than on every record
+    raise ValueError("S3_BUCKET_NAME is not set in the environment or secrets")
 
 INDEX_NAME = secrets["GOOGLE_INDEX_NAME"]
 EMBEDDING_MODEL_ID = secrets.get("EMBEDDING_MODEL_ID", "models/embedding-001")
 
+GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta"
+# Task type for indexed chunks; queries are embedded with RETRIEVAL_QUERY
+EMBED_TASK_TYPE = "RETRIEVAL_DOCUMENT"
+
 VECTOR_DIMENSION = 768
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 20
-
-
-# Initialize clients
-s3_client = boto3.client(
-    "s3",
-    region_name=S3_REGION,
-    aws_access_key_id=S3_AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=S3_AWS_SECRET_ACCESS_KEY,
+# Chunks shorter than this (after stripping whitespace) are not worth embedding
+MIN_CHUNK_LENGTH = 32
+
+# Batching for embedding calls and OpenSearch bulk requests
+EMBED_BATCH = int(os.environ.get("EMBED_BATCH", 100))
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", 5))
+EMBED_MAX_CONNECTIONS = 20
+EMBED_KEEPALIVE_TIMEOUT = 30
+EMBED_MAX_ATTEMPTS = 5
+EMBED_BACKOFF_BASE = 0.5
+
+# DynamoDB table caching embeddings by content hash (disabled when unset)
+EMBED_CACHE_TABLE = os.environ.get("EMBED_CACHE_TABLE")
+DYNAMODB_BATCH_GET_SIZE = 100
+DYNAMODB_BATCH_WRITE_SIZE = 25
+DYNAMODB_MAX_ATTEMPTS = 5
+DYNAMODB_BACKOFF_BASE = 0.05
+RECORD_WORKERS = int(os.environ.get("RECORD_WORKERS", 10))
+BULK_CHUNK = int(os.environ.get("BULK_CHUNK", 500))
+BULK_THREADS = int(os.environ.get("BULK_THREADS", 4))
+# Bulk requests all run on bulk_executor's BULK_THREADS threads, plus the refresh
+# (managed domains only)
+OPENSEARCH_POOL_MAXSIZE = BULK_THREADS + 1
+BULK_MAX_CHUNK_BYTES = 100 * 1024 * 1024
+
+# Sample used to calibrate the quantization scale of a byte index
+CALIBRATION_MAX_FILES = 20
+CALIBRATION_MAX_CHUNKS = 1000
+
+
+# Shared splitter; it holds no per-call state so threads can reuse it
+TEXT_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+    length_function=len,
+    is_separator_regex=False,
 )
 
-genai.configure(api_key=GOOGLE_API_KEY)
+# Initialize clients; S3 reads use the Lambda role, which is granted read on the bucket
+s3_client = boto3.client("s3", region_name=S3_REGION)
+
+dynamodb_client = boto3.client("dynamodb")
+
+# Shared by every record thread, so at most BULK_THREADS bulk requests are in flight.
+# Plain threads: parallel_bulk's multiprocessing pool needs /dev/shm, which Lambda lacks
+bulk_executor = ThreadPoolExecutor(max_workers=BULK_THREADS)
+
+# Long-lived event loop on a background thread owning one pooled aiohttp session,
+# so embedding calls from every worker thread and warm invocation reuse connections
+embed_loop = asyncio.new_event_loop()
+threading.Thread(target=embed_loop.run_forever, daemon=True).start()
+
+
+async def _create_embed_session() -> aiohttp.ClientSession:
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=EMBED_MAX_CONNECTIONS, keepalive_timeout=EMBED_KEEPALIVE_TIMEOUT
+        ),
+    )
+
+
+async def _create_embed_semaphore() -> asyncio.Semaphore:
+    return asyncio.Semaphore(EMBED_CONCURRENCY)
+
+
+embed_session = asyncio.run_coroutine_threadsafe(
+    _create_embed_session(), embed_loop
+).result()
+# Shared by every record thread, so at most EMBED_CONCURRENCY Gemini calls are in flight
+embed_semaphore = asyncio.run_coroutine_threadsafe(
+    _create_embed_semaphore(), embed_loop
+).result()
+
+
+async def _post_embedding_request(
+    url: str, payload: Dict[str, Any], api_key: str
+) -> Dict[str, Any]:
+    """POST to the Gemini API, retrying 429/5xx and connection errors with backoff"""
+    for attempt in range(EMBED_MAX_ATTEMPTS):
+        async with embed_semaphore:
+            # Jitter start times so requests don't hit the API in lockstep
+            await asyncio.sleep(random.uniform(0.01, 0.05))
+            try:
+                async with embed_session.post(
+                    url, json=payload, headers={"x-goog-api-key": api_key}
+                ) as response:
+                    retryable = response.status == 429 or response.status >= 500
+                    if not retryable or attempt == EMBED_MAX_ATTEMPTS - 1:
+                        response.raise_for_status()
+                        return await response.json()
+                    logger.warning(
+                        f"Embedding request returned {response.status}, retrying"
+                    )
+            except aiohttp.ClientConnectionError as e:
+                if attempt == EMBED_MAX_ATTEMPTS - 1:
+                    raise
+                logger.warning(f"Embedding request failed: {str(e)}, retrying")
+        # Back off outside the semaphore so other requests can proceed
+        await asyncio.sleep(random.uniform(0, EMBED_BACKOFF_BASE * 2**attempt))
+    raise RuntimeError("Embedding request retries exhausted")
+
+
+def quantize_vectors(vectors: List[List[float]], max_abs: float) -> List[List[int]]:
+    """Quantize float vectors to int8 for a byte knn_vector field (max_abs maps to 127)"""
+    scaled = np.round(np.asarray(vectors, dtype=np.float32) * 127 / max_abs)
+    clipped = np.count_nonzero((scaled < -128) | (scaled > 127))
+    if clipped:
+        # Clipped components lose information; a high rate means the scale is too small
+        logger.warning(
+            f"Clipped {clipped / scaled.size:.4%} of components quantizing "
+            f"{len(vectors)} vectors with max_abs {max_abs}"
+        )
+    return np.clip(scaled, -128, 127).astype(np.int8).tolist()
+
+
+class EmbeddingCache:
+    def __init__(self, table_name: str):
+        """Cache of embedding vectors keyed by SHA-256 of model, task type and chunk text"""
+        self.table_name = table_name
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        # Model and task type are part of the key so a model change never serves old vectors
+        key = f"{EMBEDDING_MODEL_ID}\n{EMBED_TASK_TYPE}\n{text}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _backoff(attempt: int) -> None:
+        time.sleep(random.uniform(0, DYNAMODB_BACKOFF_BASE * 2**attempt))
+
+    def get_many(self, hashes: List[str]) -> Dict[str, List[float]]:
+        """Fetch cached vectors for the given hashes, skipping misses"""
+        found: Dict[str, List[float]] = {}
+        unique = list(dict.fromkeys(hashes))
+        for start in range(0, len(unique), DYNAMODB_BATCH_GET_SIZE):
+            request = {
+                self.table_name: {
+                    "Keys": [
+                        {"hash": {"S": h}}
+                        for h in unique[start : start + DYNAMODB_BATCH_GET_SIZE]
+                    ],
+                    "ProjectionExpression": "#h, vector",
+                    "ExpressionAttributeNames": {"#h": "hash"},
+                }
+            }
+            for attempt in range(DYNAMODB_MAX_ATTEMPTS):
+                response = dynamodb_client.batch_get_item(RequestItems=request)
+                for item in response["Responses"].get(self.table_name, []):
+                    found[item["hash"]["S"]] = (
+                        np.frombuffer(item["vector"]["B"], dtype=np.float16)
+                        .astype(np.float32)
+                        .tolist()
+                    )
+                request = response.get("UnprocessedKeys")
+                if not request:
+                    break
+                self._backoff(attempt)
+            else:
+                # Keys still unprocessed are treated as misses and re-embedded
+                logger.warning(
+                    "Embedding cache lookup throttled, treating rest as misses"
+                )
+        return found
+
+    def put_many(self, vectors: Dict[str, List[float]]) -> None:
+        """Store vectors as float16 bytes to halve storage"""
+        items = [
+            {
+                "PutRequest": {
+                    "Item": {
+                        "hash": {"S": h},
+                        "vector": {"B": np.asarray(vector, dtype=np.float16).tobytes()},
+                    }
+                }
+            }
+            for h, vector in vectors.items()
+        ]
+        for start in range(0, len(items), DYNAMODB_BATCH_WRITE_SIZE):
+            request = {
+                self.table_name: items[start : start + DYNAMODB_BATCH_WRITE_SIZE]
+            }
+            for attempt in range(DYNAMODB_MAX_ATTEMPTS):
+                response = dynamodb_client.batch_write_item(RequestItems=request)
+                request = response.get("UnprocessedItems")
+                if not request:
+                    break
+                self._backoff(attempt)
+            else:
+                logger.warning(
+                    "Embedding cache write throttled, some vectors not cached"
+                )
 
 
 class OpenSearchStore:
     def __init__(self):
-        """Initialize OpenSearch store with Google AI embeddings and AWS authentication"""
-        self.embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL_ID)
+        """Initialize OpenSearch store with AWS authentication and the embedding cache"""
         self.client = self._initialize_client()
+        self.vector_data_type, self.quantize_max_abs = self._read_vector_format()
+        self.cache = EmbeddingCache(EMBED_CACHE_TABLE) if EMBED_CACHE_TABLE else None
 
-    def _initialize_client(self) -> OpenSearchVectorSearch:
+    def _initialize_client(self) -> OpenSearch:
         """Initialize OpenSearch client with AWS authentication"""
+        # Credentials are re-read from the secret cache before they expire
+        credentials = RefreshableCredentials.create_from_metadata(
+            metadata=opensearch_credentials(),
+            refresh_using=opensearch_credentials,
+            method="secretsmanager-cache",
+        )
         awsauth = AWS4Auth(
-            OPENSEARCH_AWS_ACCESS_KEY_ID,
-            OPENSEARCH_AWS_SECRET_ACCESS_KEY,
-            OPENSEARCH_REGION,
-            "aoss",
+            region=OPENSEARCH_REGION,
+            service="aoss" if IS_AOSS else "es",
+            refreshable_credentials=credentials,
         )
 
-        return OpenSearchVectorSearch(
-            embedding_function=self.embeddings,
-            index_name=INDEX_NAME,
-            opensearch_url=OPENSEARCH_DOMAIN_ENDPOINT,
+        return OpenSearch(
+            OPENSEARCH_DOMAIN_ENDPOINT,
             port=443,
             http_auth=awsauth,
             use_ssl=True,
             verify_certs=True,
             connection_class=RequestsHttpConnection,
+            pool_maxsize=OPENSEARCH_POOL_MAXSIZE,
         )
 
-    def add_documents(self, documents: List[Dict[str, Any]]) -> bool:
-        """Add documents to OpenSearch index"""
+    def _read_vector_format(self) -> Tuple[str, Optional[float]]:
+        """Read the vector data type and quantization scale from the index mapping"""
+        mapping = self.client.indices.get_mapping(index=INDEX_NAME)
+        mappings = next(iter(mapping.values()))["mappings"]
+        data_type = mappings["properties"]["vector_field"].get("data_type", "float")
+        if data_type != "byte":
+            return data_type, None
+        # Written by calibrate() (or index.py when given); queries must use the same
+        # scale. None until the index has been calibrated.
+        max_abs = mappings.get("_meta", {}).get("quantize_max_abs")
+        return data_type, float(max_abs) if max_abs is not None else None
+
+    def calibrate(self, texts: List[str]) -> float:
+        """Measure the quantization scale from sample texts and store it in the mapping"""
+        vectors = np.asarray(self._embed_texts(texts), dtype=np.float32)
+        max_abs = float(np.abs(vectors).max())
+        self.client.indices.put_mapping(
+            index=INDEX_NAME,
+            body={
+                "_meta": {
+                    "quantize_max_abs": max_abs,
+                    "quantize_sample_size": len(texts),
+                }
+            },
+        )
+        self.quantize_max_abs = max_abs
+        return max_abs
+
+    async def _embed_batches(
+        self, batches: List[List[str]], api_key: str
+    ) -> List[List[List[float]]]:
+        """Embed text batches concurrently via Gemini batchEmbedContents, preserving order"""
+        url = f"{GEMINI_API_URL}/{EMBEDDING_MODEL_ID}:batchEmbedContents"
+        results: List[List[List[float]]] = [[] for _ in batches]
+
+        async def embed_batch(i: int, texts: List[str]):
+            payload = {
+                "requests": [
+                    {
+                        "model": EMBEDDING_MODEL_ID,
+                        "content": {"parts": [{"text": text}]},
+                        "taskType": EMBED_TASK_TYPE,
+                    }
+                    for text in texts
+                ]
+            }
+            data = await _post_embedding_request(url, payload, api_key)
+            results[i] = [embedding["values"] for embedding in data["embeddings"]]
+
+        await asyncio.gather(
+            *(embed_batch(i, texts) for i, texts in enumerate(batches))
+        )
+        return results
+
+    async def _embed_single(self, text: str, api_key: str) -> List[float]:
+        """Embed one text via Gemini embedContent"""
+        url = f"{GEMINI_API_URL}/{EMBEDDING_MODEL_ID}:embedContent"
+        payload = {
+            "model": EMBEDDING_MODEL_ID,
+            "content": {"parts": [{"text": text}]},
+            "taskType": EMBED_TASK_TYPE,
+        }
+        data = await _post_embedding_request(url, payload, api_key)
+        return data["embedding"]["values"]
+
+    def _embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, serving repeated content from the cache when enabled"""
+        hashes = [EmbeddingCache.content_hash(text) for text in texts]
+        cached: Dict[str, List[float]] = {}
+        if self.cache:
+            try:
+                cached = self.cache.get_many(hashes)
+            except Exception as e:
+                logger.warning(f"Embedding cache lookup failed: {str(e)}")
+
+        # Embed each missing text once, even if it repeats within the document
+        misses = {h: text for h, text in zip(hashes, texts) if h not in cached}
+        miss_hashes = list(misses)
+        miss_texts = list(misses.values())
+        computed: Dict[str, List[float]] = {}
+        api_key = google_api_key() if miss_texts else ""
+        if len(miss_texts) == 1:
+            # A single text goes to the single-embed endpoint, not the batch one
+            computed = {
+                miss_hashes[0]: asyncio.run_coroutine_threadsafe(
+                    self._embed_single(miss_texts[0], api_key), embed_loop
+                ).result()
+            }
+        elif miss_texts:
+            batch_vectors = asyncio.run_coroutine_threadsafe(
+                self._embed_batches(
+                    [
+                        miss_texts[start : start + EMBED_BATCH]
+                        for start in range(0, len(miss_texts), EMBED_BATCH)
+                    ],
+                    api_key,
+                ),
+                embed_loop,
+            ).result()
+            computed = dict(
+                zip(miss_hashes, [v for vectors in batch_vectors for v in vectors])
+            )
+        if computed and self.cache:
+            try:
+                self.cache.put_many(computed)
+            except Exception as e:
+                logger.warning(f"Embedding cache write failed: {str(e)}")
+        cached.update(computed)
+
+        logger.info(
+            f"Embedded {len(miss_texts)} of {len(texts)} chunks, rest from cache"
+        )
+        return [cached[h] for h in hashes]
+
+    # Embedding invariant: a single text is embedded with embedContent
+    # (_embed_single); two or more go through batchEmbedContents (_embed_batches).
+    # Both use the pooled session, shared semaphore and EMBED_TASK_TYPE.
+    def add_documents(self, documents: List[Document]) -> bool:
+        """Embed documents (cache-first, concurrent batches) and bulk index them to OpenSearch"""
         try:
-            self.client.add_documents(documents=documents)
+            if self.vector_data_type == "byte" and self.quantize_max_abs is None:
+                # Pick up a calibration stored after this container started
+                _, self.quantize_max_abs = self._read_vector_format()
+                if self.quantize_max_abs is None:
+                    logger.error(
+                        f"Index {INDEX_NAME} has no quantization scale, "
+                        "run calibration before ingesting"
+                    )
+                    return False
+            vectors = self._embed_texts([doc.page_content for doc in documents])
+            if self.vector_data_type == "byte":
+                vectors = quantize_vectors(vectors, self.quantize_max_abs)
+            actions = [
+                {
+                    "_index": INDEX_NAME,
+                    "_source": {
+                        "text": doc.page_content,
+                        "vector_field": vector,
+                        "metadata": doc.metadata,
+                    },
+                }
+                for doc, vector in zip(documents, vectors)
+            ]
+            # No per-request refreshes (the bulk default); see refresh()
+            futures = [
+                bulk_executor.submit(
+                    bulk,
+                    self.client,
+                    actions[start : start + BULK_CHUNK],
+                    chunk_size=BULK_CHUNK,
+                    max_chunk_bytes=BULK_MAX_CHUNK_BYTES,
+                    raise_on_error=False,
+                )
+                for start in range(0, len(actions), BULK_CHUNK)
+            ]
+            failed = 0
+            for future in futures:
+                _, errors = future.result()
+                for info in errors:
+                    logger.error(f"Failed to index document: {info}")
+                failed += len(errors)
+            if failed:
+                logger.error(f"Failed to index {failed} of {len(documents)} documents")
+                return False
             logger.info(f"Added {len(documents)} documents to OpenSearch")
             return True
         except Exception as e:
             logger.error(f"Error adding documents: {str(e)}")
             return False
 
+    def refresh(self) -> None:
+        """Make documents indexed during this invocation searchable"""
+        if IS_AOSS:
+            # Serverless collections make new documents searchable on their own
+            return
+        try:
+            self.client.indices.refresh(index=INDEX_NAME)
+        except Exception as e:
+            logger.warning(f"Error refreshing index {INDEX_NAME}: {str(e)}")
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """Collect visible text from an HTML document"""
+
+    def __init__(self):
+        super().__init__()
+        self.parts: List[str] = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        if not self._skip_depth and data.strip():
+            self.parts.append(data.strip())
+
+
+def _pdf_text(body: bytes) -> str:
+    reader = PdfReader(io.BytesIO(body))
+    return "\n".join(page.extract_text() or "" for page in reader.pages)
+
+
+def _docx_text(body: bytes) -> str:
+    document = DocxDocument(io.BytesIO(body))
+    paragraphs = [paragraph.text for paragraph in document.paragraphs]
+    for table in document.tables:
+        for row in table.rows:
+            paragraphs.append(" ".join(cell.text for cell in row.cells))
+    return "\n".join(paragraphs)
+
+
+def _pptx_text(body: bytes) -> str:
+    presentation = Presentation(io.BytesIO(body))
+    return "\n".join(
+        shape.text_frame.text
+        for slide in presentation.slides
+        for shape in slide.shapes
+        if shape.has_text_frame
+    )
+
+
+def _html_text(body: bytes) -> str:
+    extractor = _HTMLTextExtractor()
+    extractor.feed(body.decode("utf-8", errors="replace"))
+    return "\n".join(extractor.parts)
+
+
+# In-memory parsers by content type
+DOCUMENT_PARSERS = {
+    "application/pdf": _pdf_text,
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": _docx_text,
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation": _pptx_text,
+    "text/html": _html_text,
+}
+# Content types decoded as UTF-8 text; unknown binary types are tried and skipped if not UTF-8
+TEXT_CONTENT_TYPES = {
+    "application/json",
+    "application/xml",
+    "application/octet-stream",
+    "binary/octet-stream",
+}
+
+
+def load_text(bucket_name: str, key: str) -> Optional[str]:
+    """Read an S3 object into memory and extract its text, or None if unsupported"""
+    response = s3_client.get_object(Bucket=bucket_name, Key=key)
+    content_type = mimetypes.guess_type(key)[0] or response.get("ContentType")
+    if content_type:
+        # S3 content types can carry parameters, e.g. "text/html; charset=utf-8"
+        content_type = content_type.split(";")[0].strip().lower()
+
+    parser = DOCUMENT_PARSERS.get(content_type)
+    is_text = content_type is None or content_type.startswith("text/")
+    if not parser and not is_text and content_type not in TEXT_CONTENT_TYPES:
+        response["Body"].close()
+        logger.warning(f"Skipping {key}: unsupported content type {content_type}")
+        return None
+
+    body = response["Body"].read()
+    if parser:
+        return parser(body)
+    try:
+        return body.decode("utf-8")
+    except UnicodeDecodeError:
+        logger.warning(f"Skipping {key}: {content_type} content is not UTF-8 text")
+        return None
+
+
+def filter_chunks(documents: List[Document]) -> List[Document]:
+    """Drop near-empty chunks and exact duplicates within a document"""
+    seen = set()
+    filtered = []
+    for doc in documents:
+        if len(doc.page_content.strip()) < MIN_CHUNK_LENGTH:
+            continue
+        digest = hashlib.sha1(doc.page_content.encode("utf-8")).digest()
+        if digest in seen:
+            continue
+        seen.add(digest)
+        filtered.append(doc)
+    return filtered
+
 
 def process_file(bucket_name: str, key: str, vector_store: OpenSearchStore) -> bool:
     """Process individual file and store in vector store"""
     try:
-        loader = S3FileLoader(bucket_name, key)
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=CHUNK_SIZE,
-            chunk_overlap=CHUNK_OVERLAP,
-            length_function=len,
-            is_separator_regex=False,
+        text = load_text(bucket_name, key)
+        if text is None:
+            # Unsupported files are acknowledged rather than retried
+            return True
+        documents = TEXT_SPLITTER.create_documents(
+            [text], metadatas=[{"source": f"s3://{bucket_name}/{key}"}]
         )
-        documents = loader.load_and_split(text_splitter=text_splitter)
+        documents = filter_chunks(documents)
         return vector_store.add_documents(documents)
     except Exception as e:
         logger.error(f"Error processing {key}: {str(e)}")
         return False
 
 
-def handler(event: Dict[str, Any], context: Any) -> None:
+# Initialize vector store once per container so warm invocations reuse its connections
+VECTOR_STORE = OpenSearchStore()
+
+
+def calibrate_index(
+    request: Dict[str, Any], vector_store: OpenSearchStore
+) -> Dict[str, Any]:
+    """Calibrate a byte index's quantization scale from chunks of real documents"""
+    if vector_store.vector_data_type != "byte":
+        return {"calibrated": False, "reason": f"{INDEX_NAME} is not a byte index"}
+    if vector_store.quantize_max_abs is not None:
+        # Indexed vectors were quantized with the stored scale; changing it needs a
+        # recreated index and re-ingestion
+        return {"calibrated": False, "reason": f"{INDEX_NAME} is already calibrated"}
+
+    bucket = request.get("bucket", S3_BUCKET_NAME)
+    response = s3_client.list_objects_v2(
+        Bucket=bucket, Prefix=request.get("prefix", ""), MaxKeys=CALIBRATION_MAX_FILES
+    )
+    texts: List[str] = []
+    for obj in response.get("Contents", []):
+        if obj["Key"].endswith("/"):
+            continue
+        text = load_text(bucket, obj["Key"])
+        if text is None:
+            continue
+        documents = filter_chunks(TEXT_SPLITTER.create_documents([text]))
+        texts.extend(doc.page_content for doc in documents)
+        if len(texts) >= CALIBRATION_MAX_CHUNKS:
+            break
+    texts = texts[:CALIBRATION_MAX_CHUNKS]
+    if not texts:
+        return {"calibrated": False, "reason": "No sample documents found"}
+
+    max_abs = vector_store.calibrate(texts)
+    logger.info(f"Calibrated {INDEX_NAME} from {len(texts)} chunks: max_abs {max_abs}")
+    return {"calibrated": True, "quantizeMaxAbs": max_abs, "sampleSize": len(texts)}
+
+
+def _process_record(record: Dict[str, Any], vector_store: OpenSearchStore) -> bool:
+    """Process a single SQS record, returning whether it was indexed successfully"""
+    try:
+        # Parse metadata from SQS message
+        metadata = json.loads(record["body"])
+
+        # Process file
+        if process_file(metadata["bucket"], metadata["key"], vector_store):
+            logger.info(f"Successfully processed and indexed {metadata['key']}")
+            return True
+
+        logger.warning(f"Failed to process {metadata['key']}")
+        return False
+
+    except Exception as e:
+        logger.error(f"Error processing message: {e}")
+        return False
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Lambda handler to process SQS messages, generate embeddings, and index to OpenSearch
     """
-    # Initialize vector store
-    vector_store = OpenSearchStore()
+    # Invoked directly with {"Calibrate": {"prefix": ...}} to calibrate a byte index
+    if "Calibrate" in event:
+        return calibrate_index(event["Calibrate"], VECTOR_STORE)
+
+    records = event["Records"]
+    if not records:
+        return {"batchItemFailures": []}
+
+    # Process SQS records in parallel; the work is I/O bound so threads overlap well
+    with ThreadPoolExecutor(max_workers=min(RECORD_WORKERS, len(records))) as executor:
+        results = list(
+            executor.map(lambda record: _process_record(record, VECTOR_STORE), records)
+        )
 
-    # Process each SQS record
-    for record in event["Records"]:
-        try:
-            # Parse metadata from SQS message
-            metadata = json.loads(record["body"])
+    if any(results):
+        VECTOR_STORE.refresh()
 
-            # Process file
-            if process_file(metadata["bucket"], metadata["key"], vector_store):
-                logger.info(f"Successfully processed and indexed {metadata['key']}")
-            else:
-                logger.warning(f"Failed to process {metadata['key']}")
-
-        except Exception as e:
-            logger.error(f"Error processing message: {e}")
-            continue
+    # Only failed messages are returned to the queue for retry
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": record["messageId"]}
+            for record, succeeded in zip(records, results)
+            if not succeeded
+        ]
+    }
 
 
 # Local testing
@@ -178,6 +717,7 @@ if __name__ == "__main__":
     test_event = {
         "Records": [
             {
+                "messageId": "local-test",
                 "body": json.dumps(
                     {
                         "bucket": "rag-demo-manual",
@@ -187,7 +727,7 @@ if __name__ == "__main__":
                         "contentType": "text/plain",
                         "path": "20241129",
                     }
-                )
+                ),
             }
         ]
     }
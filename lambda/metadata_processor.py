@@ -1,69 +1,350 @@
 import json
 import logging
+import mimetypes
 import os
+import queue
+import random
+import string
+import threading
+import time
 import boto3
-from botocore.exceptions import ClientError
-from typing import Dict, Any, List
+from botocore.exceptions import BotoCoreError, ClientError
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Callable, Deque, Iterator, List, Optional, Tuple
 from datetime import datetime
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# SQS accepts at most 10 entries per send_message_batch call
+SQS_BATCH_SIZE = 10
+SEND_MAX_ATTEMPTS = 3
+SEND_BACKOFF_BASE = 0.1
+SEND_WORKERS = int(os.environ.get("SEND_WORKERS", 4))
 
-def get_metadata_for_files(bucket: str, prefix: str) -> List[Dict[str, Any]]:
+# Listing configuration
+LIST_PAGE_SIZE = 1000
+LIST_WORKERS = int(os.environ.get("LIST_WORKERS", 16))
+# Character classes for StartAfter shard boundaries, each in S3 (UTF-8 byte) order
+SHARD_CLASSES = (string.digits, string.ascii_uppercase, string.ascii_lowercase)
+SHARD_ALPHABET = "".join(SHARD_CLASSES)
+
+
+def build_metadata(
+    bucket: str, key: str, size: int, last_modified: datetime
+) -> Dict[str, Any]:
+    """
+    Build the SQS message body for a single file.
+    """
+    return {
+        "bucket": bucket,
+        "key": key,
+        "size": size,
+        "lastModified": last_modified.isoformat(),
+        "contentType": mimetypes.guess_type(key)[0] or "application/octet-stream",
+        "path": os.path.dirname(key),
+    }
+
+
+def key_ranges(page_keys: List[str]) -> List[Tuple[str, Optional[str]]]:
+    """
+    Split the keys after the first page into (exclusive lower, inclusive upper) ranges.
+
+    Boundaries follow the naming seen in the first page: the part its keys share is
+    extended by one or two characters from the classes used where they start to
+    differ (e.g. digits for 'doc_0001.pdf' ... 'doc_1000.pdf'). The last range is
+    open-ended, so every key sorting after the first page falls in exactly one range.
+    """
+    start_after = page_keys[-1]
+    stem = os.path.commonprefix([page_keys[0], start_after])
+    observed = {key[len(stem)] for key in page_keys if len(key) > len(stem)}
+    alphabet = "".join(c for c in SHARD_CLASSES if observed & set(c)) or SHARD_ALPHABET
+
+    candidates = [stem + c for c in alphabet if stem + c > start_after]
+    if len(candidates) < LIST_WORKERS - 1:
+        candidates = [
+            stem + c1 + c2
+            for c1 in alphabet
+            for c2 in alphabet
+            if stem + c1 + c2 > start_after
+        ]
+    step = max(1, len(candidates) // LIST_WORKERS)
+    boundaries = candidates[step::step][: LIST_WORKERS - 1]
+    lowers = [start_after] + boundaries
+    uppers: List[Optional[str]] = boundaries + [None]
+    return list(zip(lowers, uppers))
+
+
+def list_key_range(
+    s3_client,
+    bucket: str,
+    prefix: str,
+    start_after: str,
+    end: Optional[str],
+    emit: Callable[[List[Dict[str, Any]]], bool],
+) -> None:
+    """
+    List keys in (start_after, end] and emit metadata one page at a time.
+    """
+    try:
+        paginator = s3_client.get_paginator("list_objects_v2")
+        pages = paginator.paginate(
+            Bucket=bucket,
+            Prefix=prefix,
+            StartAfter=start_after,
+            PaginationConfig={"PageSize": LIST_PAGE_SIZE},
+        )
+        for page in pages:
+            contents = page.get("Contents", [])
+            in_range = [obj for obj in contents if end is None or obj["Key"] <= end]
+            metadata_page = [
+                build_metadata(bucket, obj["Key"], obj["Size"], obj["LastModified"])
+                for obj in in_range
+                # Skip if it's a folder (ends with '/')
+                if not obj["Key"].endswith("/")
+            ]
+            if metadata_page and not emit(metadata_page):
+                return
+            # Stop once the listing has passed the end of this range
+            if len(in_range) < len(contents):
+                return
+    except ClientError as list_error:
+        logger.error(f"Error listing objects after {start_after}: {list_error}")
+
+
+def get_metadata_for_files(bucket: str, prefix: str) -> Iterator[Dict[str, Any]]:
     """
     Retrieve metadata for all files in a specific S3 prefix/folder.
 
+    The first page is listed directly. If the folder has more keys, the rest of
+    the key space is split into StartAfter ranges listed in parallel, and pages
+    are yielded as they arrive through a bounded queue.
+
     Args:
         bucket: S3 bucket name
         prefix: S3 folder prefix (e.g., '20241020/')
 
-    Returns:
-        List of metadata dictionaries
+    Yields:
+        Metadata dictionaries, one per file
     """
     s3_client = boto3.client("s3")
-    metadata_list = []
 
     try:
-        # List objects in the specified folder
-        paginator = s3_client.get_paginator("list_objects_v2")
-        pages = paginator.paginate(Bucket=bucket, Prefix=prefix)
+        first_page = s3_client.list_objects_v2(
+            Bucket=bucket, Prefix=prefix, MaxKeys=LIST_PAGE_SIZE
+        )
+    except ClientError as list_error:
+        logger.error(f"Error listing objects: {list_error}")
+        return
 
-        for page in pages:
-            if "Contents" not in page:
+    contents = first_page.get("Contents", [])
+    for obj in contents:
+        # Skip if it's a folder (ends with '/')
+        if obj["Key"].endswith("/"):
+            continue
+
+        # list_objects_v2 already returns size and timestamp, so no
+        # per-key head_object call is needed
+        yield build_metadata(bucket, obj["Key"], obj["Size"], obj["LastModified"])
+
+    if not first_page.get("IsTruncated") or not contents:
+        return
+
+    ranges = key_ranges([obj["Key"] for obj in contents])
+    pages: "queue.Queue[Optional[List[Dict[str, Any]]]]" = queue.Queue(
+        maxsize=LIST_WORKERS * 2
+    )
+    stop = threading.Event()
+
+    def emit(item: Optional[List[Dict[str, Any]]]) -> bool:
+        # Block while the consumer catches up, unless it has gone away
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=1)
+                return True
+            except queue.Full:
                 continue
+        return False
 
-            for obj in page["Contents"]:
+    def list_shard(start_after: str, end: Optional[str]) -> None:
+        try:
+            list_key_range(s3_client, bucket, prefix, start_after, end, emit)
+        finally:
+            # None marks this shard as finished
+            emit(None)
+
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [executor.submit(list_shard, lower, upper) for lower, upper in ranges]
+        try:
+            remaining = len(futures)
+            while remaining:
+                page = pages.get()
+                if page is None:
+                    remaining -= 1
+                    continue
+                yield from page
+        finally:
+            stop.set()
+
+        # result() re-raises anything a shard did not handle
+        for future in futures:
+            future.result()
+
+
+def get_metadata_from_inventory(
+    bucket: str, prefix: str, inventory_bucket: str, inventory_prefix: str
+) -> Iterator[Dict[str, Any]]:
+    """
+    Retrieve metadata for files under a prefix from the latest S3 Inventory report.
+
+    Args:
+        bucket: S3 bucket name
+        prefix: S3 folder prefix (e.g., '20241020/')
+        inventory_bucket: Bucket the Parquet inventory is delivered to
+        inventory_prefix: Inventory destination path up to the configuration ID
+            (e.g., 'inventory/rag-demo-manual/daily')
+
+    Yields:
+        Metadata dictionaries, one per file
+    """
+    # pyarrow is only needed for the inventory path, so import it lazily
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    s3_client = boto3.client("s3")
+
+    try:
+        # Each delivery lives in a timestamped folder, e.g. 2024-11-29T01-00Z/
+        paginator = s3_client.get_paginator("list_objects_v2")
+        deliveries = [
+            p["Prefix"]
+            for page in paginator.paginate(
+                Bucket=inventory_bucket,
+                Prefix=inventory_prefix.rstrip("/") + "/",
+                Delimiter="/",
+            )
+            for p in page.get("CommonPrefixes", [])
+            if p["Prefix"].rstrip("/").rsplit("/", 1)[-1][:1].isdigit()
+        ]
+        if not deliveries:
+            logger.error(f"No inventory found under {inventory_prefix}")
+            return
+
+        manifest = json.loads(
+            s3_client.get_object(
+                Bucket=inventory_bucket, Key=max(deliveries) + "manifest.json"
+            )["Body"].read()
+        )
+
+        for data_file in manifest["files"]:
+            body = s3_client.get_object(Bucket=inventory_bucket, Key=data_file["key"])[
+                "Body"
+            ].read()
+            table = pq.read_table(
+                pa.BufferReader(body), columns=["key", "size", "last_modified_date"]
+            )
+            table = table.filter(pc.starts_with(table["key"], prefix))
+            for row in table.to_pylist():
                 # Skip if it's a folder (ends with '/')
-                if obj["Key"].endswith("/"):
+                if row["key"].endswith("/"):
                     continue
+                yield build_metadata(
+                    bucket, row["key"], row["size"], row["last_modified_date"]
+                )
 
-                try:
-                    # Get full metadata for each file
-                    response = s3_client.head_object(Bucket=bucket, Key=obj["Key"])
-
-                    metadata = {
-                        "bucket": bucket,
-                        "key": obj["Key"],
-                        "size": response.get("ContentLength", 0),
-                        "lastModified": response.get("LastModified", "").isoformat(),
-                        "contentType": response.get(
-                            "ContentType", "application/octet-stream"
-                        ),
-                        "path": os.path.dirname(obj["Key"]),
-                    }
-                    metadata_list.append(metadata)
-
-                except ClientError as head_error:
-                    logger.error(
-                        f"Error getting metadata for {obj['Key']}: {head_error}"
-                    )
+    except ClientError as inventory_error:
+        logger.error(f"Error reading inventory: {inventory_error}")
 
-    except ClientError as list_error:
-        logger.error(f"Error listing objects: {list_error}")
 
-    return metadata_list
+def send_message_with_retry(
+    sqs_client, queue_url: str, metadata: Dict[str, Any]
+) -> bool:
+    """
+    Send a single metadata message, retrying with exponential backoff and jitter.
+    """
+    for attempt in range(SEND_MAX_ATTEMPTS):
+        try:
+            sqs_client.send_message(
+                QueueUrl=queue_url, MessageBody=json.dumps(metadata)
+            )
+            logger.info(f"Sent metadata for {metadata['key']} to SQS")
+            return True
+        except (ClientError, BotoCoreError) as sqs_error:
+            if attempt == SEND_MAX_ATTEMPTS - 1:
+                logger.error(
+                    f"Failed to send message to SQS for {metadata['key']}: {sqs_error}"
+                )
+                return False
+            time.sleep(random.uniform(0, SEND_BACKOFF_BASE * 2**attempt))
+    return False
+
+
+def send_metadata_batch(sqs_client, queue_url: str, batch: List[Dict[str, Any]]) -> int:
+    """
+    Send up to SQS_BATCH_SIZE metadata messages in one call, retrying failed entries.
+
+    Returns:
+        Number of messages that could not be sent
+    """
+    entries = [
+        {"Id": str(i), "MessageBody": json.dumps(metadata)}
+        for i, metadata in enumerate(batch)
+    ]
+    try:
+        response = sqs_client.send_message_batch(QueueUrl=queue_url, Entries=entries)
+        failed = {int(entry["Id"]) for entry in response.get("Failed", [])}
+    except (ClientError, BotoCoreError) as sqs_error:
+        logger.error(f"Failed to send message batch to SQS: {sqs_error}")
+        failed = set(range(len(batch)))
+
+    unsent = 0
+    for i, metadata in enumerate(batch):
+        if i not in failed:
+            logger.info(f"Sent metadata for {metadata['key']} to SQS")
+        elif not send_message_with_retry(sqs_client, queue_url, metadata):
+            unsent += 1
+    return unsent
+
+
+def send_metadata(
+    sqs_client, queue_url: str, metadata_iter: Iterator[Dict[str, Any]]
+) -> int:
+    """
+    Buffer metadata into SQS-sized batches and send them on worker threads, so
+    listing continues while earlier batches are in flight.
+
+    Returns:
+        Number of messages that could not be sent; unexpected errors are raised
+    """
+    # Bound the number of queued batches to keep memory flat on large prefixes
+    max_pending = SEND_WORKERS * 2
+    pending: Deque[Future] = deque()
+    unsent = 0
+
+    with ThreadPoolExecutor(max_workers=SEND_WORKERS) as executor:
+        batch: List[Dict[str, Any]] = []
+        for metadata in metadata_iter:
+            batch.append(metadata)
+            if len(batch) == SQS_BATCH_SIZE:
+                if len(pending) >= max_pending:
+                    unsent += pending.popleft().result()
+                pending.append(
+                    executor.submit(send_metadata_batch, sqs_client, queue_url, batch)
+                )
+                batch = []
+        if batch:
+            pending.append(
+                executor.submit(send_metadata_batch, sqs_client, queue_url, batch)
+            )
+
+        # result() re-raises anything a worker did not handle
+        while pending:
+            unsent += pending.popleft().result()
+
+    return unsent
 
 
 def handler(event: Dict[str, Any], context: Any) -> None:
@@ -85,20 +366,24 @@ def handler(event: Dict[str, Any], context: Any) -> None:
     # Initialize SQS client
     sqs_client = boto3.client("sqs")
 
-    # Get metadata for all files
-    metadata_list = get_metadata_for_files(bucket, prefix)
+    # Read file metadata from S3 Inventory when configured, else list the folder
+    if os.environ.get("USE_INVENTORY"):
+        inventory_prefix = os.environ.get("INVENTORY_PREFIX")
+        if not inventory_prefix:
+            raise ValueError("INVENTORY_PREFIX must be set when USE_INVENTORY is set")
+        metadata_iter = get_metadata_from_inventory(
+            bucket,
+            prefix,
+            os.environ.get("INVENTORY_BUCKET", bucket),
+            inventory_prefix,
+        )
+    else:
+        metadata_iter = get_metadata_for_files(bucket, prefix)
 
-    # Send each file's metadata to SQS
-    for metadata in metadata_list:
-        try:
-            sqs_client.send_message(
-                QueueUrl=queue_url, MessageBody=json.dumps(metadata)
-            )
-            logger.info(f"Sent metadata for {metadata['key']} to SQS")
-        except ClientError as sqs_error:
-            logger.error(
-                f"Failed to send message to SQS for {metadata['key']}: {sqs_error}"
-            )
+    # Stream metadata for all files to SQS as the listing progresses
+    unsent = send_metadata(sqs_client, queue_url, metadata_iter)
+    if unsent:
+        logger.error(f"{unsent} metadata messages could not be sent to SQS")
 
 
 # For local testing
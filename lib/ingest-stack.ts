@@ -9,6 +9,7 @@ import * as lambdaEventSources from 'aws-cdk-lib/aws-lambda-event-sources';
 import * as iam from 'aws-cdk-lib/aws-iam';
 import * as ec2 from 'aws-cdk-lib/aws-ec2';
 import * as efs from 'aws-cdk-lib/aws-efs';
+import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
 import * as path from 'path';
 
 interface IngestStackProps extends cdk.StackProps {
@@ -18,12 +19,18 @@ interface IngestStackProps extends cdk.StackProps {
     projectName: string;
     bastion: ec2.BastionHostLinux;  // Add bastion to props
     secretArn?: string;
+    // S3 Inventory (Parquet) read by the metadata processor instead of listing the folder
+    inventory?: {
+        bucket: s3.IBucket;
+        prefix: string;  // destination path up to the configuration ID
+    };
 }
 
 export class IngestStack extends cdk.Stack {
     public readonly metadataProcessor: lambda.Function;
     public readonly ingestionProcessor: lambda.Function;
     public readonly queue: sqs.Queue;
+    public readonly embeddingCache: dynamodb.Table;
 
     constructor(scope: Construct, id: string, props: IngestStackProps) {
         super(scope, id, props);
@@ -33,6 +40,7 @@ export class IngestStack extends cdk.Stack {
 
         // Create infrastructure
         this.queue = this.createQueue();
+        this.embeddingCache = this.createEmbeddingCache();
         const fileSystem = this.createFileSystem(props);
         const accessPoint = this.createEfsAccessPoint(fileSystem);
 
@@ -63,6 +71,18 @@ export class IngestStack extends cdk.Stack {
         });
     }
 
+    private createEmbeddingCache(): dynamodb.Table {
+        // Embedding vectors keyed by SHA-256 of the chunk text
+        return new dynamodb.Table(this, 'EmbeddingCacheTable', {
+            partitionKey: {
+                name: 'hash',
+                type: dynamodb.AttributeType.STRING
+            },
+            billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+            removalPolicy: cdk.RemovalPolicy.DESTROY,
+        });
+    }
+
     private createFileSystem(props: IngestStackProps): efs.FileSystem {
         // Create security group for EFS
         const efsSecurityGroup = new ec2.SecurityGroup(this, 'EfsSecurityGroup', {
@@ -135,6 +155,23 @@ export class IngestStack extends cdk.Stack {
         });
     }
 
+    private createDependencyLayer(id: string, directory: string, description: string): lambda.LayerVersion {
+        // Third-party packages are installed from requirements.txt at synth time
+        return new lambda.LayerVersion(this, id, {
+            code: lambda.Code.fromAsset(path.join(__dirname, '../layers', directory), {
+                bundling: {
+                    image: lambda.Runtime.PYTHON_3_10.bundlingImage,
+                    command: [
+                        'bash', '-c',
+                        'pip install -r requirements.txt -t /asset-output/python --no-cache-dir',
+                    ],
+                },
+            }),
+            compatibleRuntimes: [lambda.Runtime.PYTHON_3_10],
+            description,
+        });
+    }
+
     private createMetadataProcessor(props: IngestStackProps): lambda.Function {
         const securityGroup = new ec2.SecurityGroup(this, 'MetadataProcessorSG', {
             vpc: props.vpc,
@@ -157,22 +194,36 @@ export class IngestStack extends cdk.Stack {
         );
 
 
+        // pyarrow is only needed to read the inventory, so the layer ships only with it
+        const inventory = props.inventory;
+
         const lambdaFunction = new lambda.Function(this, 'MetadataProcessorLambda', {
             runtime: lambda.Runtime.PYTHON_3_10,
             handler: 'metadata_processor.handler',
             code: lambda.Code.fromAsset(path.join(__dirname, '../lambda')),
+            layers: inventory ? [
+                this.createDependencyLayer('MetadataDependenciesLayer', 'metadata',
+                    'pyarrow for the metadata processor inventory path'),
+            ] : [],
             vpc: props.vpc,
             securityGroups: [securityGroup],
             environment: {
                 S3_BUCKET_NAME: props.s3Bucket.bucketName,
                 QUEUE_URL: this.queue.queueUrl,
+                ...(inventory ? {
+                    USE_INVENTORY: 'true',
+                    INVENTORY_BUCKET: inventory.bucket.bucketName,
+                    INVENTORY_PREFIX: inventory.prefix,
+                } : {}),
             },
             timeout: cdk.Duration.minutes(5),
-            memorySize: 256,
+            // Inventory Parquet files are read into memory
+            memorySize: inventory ? 1024 : 256,
             retryAttempts: 2,
         });
 
         props.s3Bucket.grantRead(lambdaFunction);
+        inventory?.bucket.grantRead(lambdaFunction);
         this.queue.grantSendMessages(lambdaFunction);
 
         return lambdaFunction;
@@ -211,6 +262,10 @@ export class IngestStack extends cdk.Stack {
             runtime: lambda.Runtime.PYTHON_3_10,
             handler: 'ingestion_processor.handler',
             code: lambda.Code.fromAsset(path.join(__dirname, '../lambda')),
+            layers: [
+                this.createDependencyLayer('IngestionDependenciesLayer', 'ingestion',
+                    'Third-party packages for the ingestion processor'),
+            ],
             vpc: props.vpc,
             securityGroups: [securityGroup],
             filesystem: lambda.FileSystem.fromEfsAccessPoint(accessPoint, '/mnt/lambda'),
@@ -220,6 +275,7 @@ export class IngestStack extends cdk.Stack {
             environment: {
                 QUEUE_URL: this.queue.queueUrl,
                 S3_BUCKET_NAME: props.s3Bucket.bucketName,
+                EMBED_CACHE_TABLE: this.embeddingCache.tableName,
             },
         });
 
@@ -231,6 +287,15 @@ export class IngestStack extends cdk.Stack {
         // S3 permissions
         props.s3Bucket.grantRead(this.ingestionProcessor);
 
+        // SQS event source; only records listed in batchItemFailures are retried
+        this.ingestionProcessor.addEventSource(new lambdaEventSources.SqsEventSource(this.queue, {
+            batchSize: 10,
+            reportBatchItemFailures: true,
+        }));
+
+        // Embedding cache permissions
+        this.embeddingCache.grantReadWriteData(this.ingestionProcessor);
+
         // EFS permissions
         this.ingestionProcessor.connections.allowTo(
             fileSystem,
@@ -246,7 +311,7 @@ export class IngestStack extends cdk.Stack {
         // Secrets Manager permissions
         if (props.secretArn) {
             this.ingestionProcessor.addToRolePolicy(new iam.PolicyStatement({
-                actions: ['secretsmanager:GetSecretValue'],
+                actions: ['secretsmanager:GetSecretValue', 'secretsmanager:DescribeSecret'],
                 resources: [props.secretArn],
             }));
         }
@@ -89,6 +89,22 @@ export class OpensearchBedrockRagCdkStack extends cdk.Stack {
       type: 'VECTORSEARCH',
     });
 
+    // Dependencies for the index Lambda are bundled into a layer at synth time
+    // instead of being pip-installed into /tmp on every cold start
+    const openSearchLayer = new lambda.LayerVersion(this, 'OpenSearchPyLayer', {
+      code: lambda.Code.fromAsset(path.join(__dirname, '../layers/opensearch'), {
+        bundling: {
+          image: lambda.Runtime.PYTHON_3_9.bundlingImage,
+          command: [
+            'bash', '-c',
+            'pip install -r requirements.txt -t /asset-output/python --no-cache-dir',
+          ],
+        },
+      }),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_9],
+      description: 'opensearch-py, requests and urllib3 for the index Lambda',
+    });
+
     // Create Lambda function for custom resource
     const createIndexLambda = new lambda.Function(this, 'CreateIndexLambda', {
       functionName: 'CreateIndexFunction',
@@ -105,6 +121,7 @@ export class OpensearchBedrockRagCdkStack extends cdk.Stack {
       handler: 'index.handler',
       runtime: lambda.Runtime.PYTHON_3_9,
       code: lambda.Code.fromAsset('lambda'), // Path to your Lambda function code
+      layers: [openSearchLayer],
       timeout: cdk.Duration.minutes(5),
       initialPolicy: [
         new iam.PolicyStatement({
@@ -205,6 +222,10 @@ export class OpensearchBedrockRagCdkStack extends cdk.Stack {
       timeout: cdk.Duration.minutes(5),
     });
 
+    // Stays 'float' until the query side (the ECS app) quantizes its query vectors,
+    // since a byte field rejects float queries. 'byte' is opt-in, see the README.
+    const geminiVectorDataType = 'float';
+
     const geminiVectorIndex = new cr.AwsCustomResource(this, 'GeminiVectorIndexResource', {
       installLatestAwsSdk: true,
       onCreate: {
@@ -218,6 +239,28 @@ export class OpensearchBedrockRagCdkStack extends cdk.Stack {
             CollectionName: collection.name,
             IndexName: 'aoss-index',
             VectorDimension: 768,
+            VectorDataType: geminiVectorDataType,
+            Endpoint: Endpoint,
+          }),
+        },
+        physicalResourceId: cr.PhysicalResourceId.of('gemini-vector-index'),
+      },
+      // Existing stacks get an Update: a missing index is created, while an existing
+      // index of another data type is kept as is (ingestion follows the index
+      // mapping). Set RecreateOnMismatch to true to rebuild it, then re-run ingestion.
+      onUpdate: {
+        service: 'Lambda',
+        action: 'invoke',
+        parameters: {
+          FunctionName: createIndexLambda.functionName,
+          InvocationType: 'RequestResponse',
+          Payload: JSON.stringify({
+            RequestType: 'Update',
+            CollectionName: collection.name,
+            IndexName: 'aoss-index',
+            VectorDimension: 768,
+            VectorDataType: geminiVectorDataType,
+            RecreateOnMismatch: false,
             Endpoint: Endpoint,
           }),
         },
@@ -0,0 +1,106 @@
+import os
+import sys
+import unittest
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+import metadata_processor  # noqa: E402
+
+
+class FakeS3:
+    """In-memory stand-in for the list_objects_v2 calls the listing makes"""
+
+    def __init__(self, keys: List[str]):
+        self.keys = sorted(keys)
+        self.list_calls = 0
+
+    def list_objects_v2(
+        self, Bucket: str, Prefix: str, MaxKeys: int = 1000, StartAfter: str = ""
+    ) -> Dict[str, Any]:
+        self.list_calls += 1
+        matching = [k for k in self.keys if k.startswith(Prefix) and k > StartAfter]
+        return {
+            "Contents": [
+                {
+                    "Key": key,
+                    "Size": 1,
+                    "LastModified": datetime(2024, 10, 20, tzinfo=timezone.utc),
+                }
+                for key in matching[:MaxKeys]
+            ],
+            "IsTruncated": len(matching) > MaxKeys,
+        }
+
+    def get_paginator(self, operation: str) -> "FakeS3":
+        return self
+
+    def paginate(
+        self, Bucket: str, Prefix: str, StartAfter: str, PaginationConfig: Dict
+    ) -> Iterator[Dict[str, Any]]:
+        while True:
+            page = self.list_objects_v2(
+                Bucket, Prefix, PaginationConfig["PageSize"], StartAfter
+            )
+            yield page
+            if not page["IsTruncated"]:
+                return
+            StartAfter = page["Contents"][-1]["Key"]
+
+
+def list_keys(keys: List[str], prefix: str) -> List[str]:
+    with mock.patch.object(
+        metadata_processor.boto3, "client", return_value=FakeS3(keys)
+    ):
+        return [
+            m["key"] for m in metadata_processor.get_metadata_for_files("b", prefix)
+        ]
+
+
+class KeyRangesTest(unittest.TestCase):
+    def assert_partition(self, page_keys: List[str], later_keys: List[str]) -> None:
+        ranges = metadata_processor.key_ranges(page_keys)
+        self.assertEqual(ranges[0][0], page_keys[-1])
+        self.assertIsNone(ranges[-1][1])
+        for (_, upper), (lower, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(upper, lower)
+        for key in later_keys:
+            owners = [r for r in ranges if key > r[0] and (r[1] is None or key <= r[1])]
+            self.assertEqual(len(owners), 1, key)
+
+    def test_ranges_partition_keys_after_first_page(self):
+        page = [f"20241020/doc_{i:04d}.pdf" for i in range(1, 1001)]
+        later = [f"20241020/doc_{i:04d}.pdf" for i in range(1001, 10000)]
+        later += ["20241020/doc_2", "20241020/doc_99", "20241020/z", "20241020/é"]
+        self.assert_partition(page, later)
+
+    def test_uniform_names_spread_over_shards(self):
+        page = [f"20241020/doc_{i:04d}.pdf" for i in range(1, 1001)]
+        later = [f"20241020/doc_{i:04d}.pdf" for i in range(1001, 10000)]
+        ranges = metadata_processor.key_ranges(page)
+        sizes = [
+            sum(1 for k in later if k > lower and (upper is None or k <= upper))
+            for lower, upper in ranges
+        ]
+        self.assertEqual(len(ranges), metadata_processor.LIST_WORKERS)
+        self.assertLess(max(sizes), len(later) // 4)
+
+
+class GetMetadataForFilesTest(unittest.TestCase):
+    def test_lists_every_key_once(self):
+        keys = [f"20241020/doc_{i:04d}.pdf" for i in range(1, 5001)]
+        keys += ["20241020/5a", "20241020/~z", "20241020/!a", "20241020/é"]
+        keys += ["20241020/sub/", "20241021/doc_0001.pdf"]
+        listed = list_keys(keys, "20241020/")
+        expected = [k for k in keys if k.startswith("20241020/") and k[-1] != "/"]
+        self.assertEqual(sorted(listed), sorted(expected))
+
+    def test_single_page_is_not_sharded(self):
+        keys = [f"20241020/doc_{i:04d}.pdf" for i in range(1, 11)]
+        self.assertEqual(sorted(list_keys(keys, "20241020/")), keys)
+
+
+if __name__ == "__main__":
+    unittest.main()